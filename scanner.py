@@ -24,27 +24,66 @@
 ################################################################################
 
 # from standard library
+import array
+import codecs
+import collections
+import functools
 import json
 import os
 import re
+import socket
+import sqlite3
 import time
 import urllib
 import webbrowser
 
 # threading
+from concurrent import futures
 from contextlib import closing
-from queue import Queue
 import threading
 
 # GUI toolkit
 import wx
 from wx.adv import AboutBox
 
-# HTML parser
-from bs4 import BeautifulSoup, SoupStrainer
+# HTML parser (optional; the tree lives in C and selection does not
+# create a Python object per node, so it is preferred over the regex
+# fallback when installed)
+try:
+	from selectolax.lexbor import LexborHTMLParser
+except ImportError:
+	LexborHTMLParser = None
 
 # HTTP
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Bloom filter (optional, bounds link cache memory on large crawls)
+try:
+	from pybloom_live import ScalableBloomFilter
+except ImportError:
+	ScalableBloomFilter = None
+
+# faster JSON (optional, used for configuration serialization)
+try:
+	import orjson
+except ImportError:
+	orjson = None
+
+if orjson is not None:
+	def json_dumps(value):
+		return orjson.dumps(value).decode()
+
+	json_loads = orjson.loads
+else:
+	json_dumps = json.dumps
+	json_loads = json.loads
+
+# caches DNS resolutions in-process: a crawl hits the same few hosts
+# repeatedly, and fresh connections would otherwise repeat the lookup
+# whenever the OS resolver cache is cold; failed lookups are not cached
+socket.getaddrinfo = functools.lru_cache(maxsize=256)(socket.getaddrinfo)
 
 ################################################################################
 # Global variables                                                             #
@@ -59,11 +98,37 @@ VERSION = '1.0.0'
 MAIN_FRAME_SIZE = (1000, 600)
 SUB_FRAME_SIZE = (600, 400)
 
+# interval between batched list control updates (ms)
+FLUSH_INTERVAL = 50
+
+# scanner results per cross-thread event, and the longest a result may
+# wait before being posted anyway (s)
+BATCH_SIZE = 32
+BATCH_INTERVAL = 0.05
+
+# delay before the search field filters the list (ms)
+SEARCH_DELAY = 150
+
 # scan settings
-HTML_TAGS = ('a', 'img', 'link')
 CONTENT_TYPES = ('text/html', 'application/xhtml+xml')
-ACCEPT_SCHEMES = ('http', 'https')
-IGNORE_SCHEMES = ('mailto', 'javascript') # not reported under "Skipped" filter
+
+# largest page body read for link extraction, and the read block size
+MAX_CONTENT_SIZE = 2 * 1024 * 1024
+CHUNK_SIZE = 65536
+
+# nodes scanned for links when the C parser is available, and the
+# fallback pattern that pulls href/src values straight from the page
+# in a single pass without building a tree
+LINK_SELECTOR = 'a[href], link[href], img[src]'
+LINK_RE = re.compile(r'''(?:href|src)\s*=\s*["']([^"'>\s]+)''', re.I)
+ACCEPT_SCHEMES = frozenset(('http', 'https'))
+
+# detects backreferences in user rules, which cannot be combined with
+# other rules without renumbering their capturing groups
+BACKREFERENCE_RE = re.compile(r'\\[1-9]|\(\?P=')
+
+# not reported under "Skipped" filter
+IGNORE_SCHEMES = frozenset(('mailto', 'javascript'))
 
 # link follow modes
 IGNORE = 0
@@ -84,6 +149,26 @@ EXTERNAL = 2
 INCLUDE = False
 EXCLUDE = True
 
+# query string parameters ignored when comparing URLs
+TRACKING_PARAMS = ('utm_', 'fbclid', 'gclid')
+
+# link cache Bloom filter settings
+BLOOM_CAPACITY = 10000
+BLOOM_ERROR_RATE = 0.001
+
+# connection pool settings
+POOL_CONNECTIONS = 64
+PER_HOST_CONNECTIONS = 4
+RETRY_TOTAL = 2
+RETRY_BACKOFF = 0.3
+
+# maximum number of finished tasks kept for reuse
+FREE_TASKS = 256
+
+# persistent URL cache settings
+CACHE_FILE = 'urlcache.db'
+CACHE_TTL = 86400 # seconds before a cached status expires
+
 # unique IDs for worker thread
 EVT_RESULT_ID = wx.NewIdRef(count=1)
 ID_START = wx.NewIdRef(count=1)
@@ -91,56 +176,64 @@ ID_STOP = wx.NewIdRef(count=1)
 
 # HTTP status codes
 STATUS_CODES = {
-	'200': 'OK',
-	'201': 'Created',
-	'202': 'Accepted',
-	'203': 'Non-Authoritative Information',
-	'204': 'No Content',
-	'205': 'Reset Content',
-	'206': 'Partial Content',
-	'300': 'Multiple Choices',
-	'301': 'Moved Permanently',
-	'302': 'Found',
-	'303': 'See Other',
-	'304': 'Not Modified',
-	'305': 'Use Proxy',
-	'306': 'Switch Proxy',
-	'307': 'Temporary Redirect',
-	'308': 'Permanent Redirect',
-	'400': 'Bad Request',
-	'401': 'Unauthorized',
-	'403': 'Forbidden',
-	'404': 'Not Found',
-	'405': 'Method Not Allowed',
-	'406': 'Not Accepted',
-	'407': 'Proxy Authentication Required',
-	'408': 'Request Timed Out',
-	'409': 'Conflict',
-	'410': 'Gone',
-	'411': 'Length Required',
-	'412': 'Precondition Failed',
-	'413': 'Payload Too Large',
-	'414': 'URI Too Large',
-	'415': 'Unsupported Media Type',
-	'416': 'Range Not Satisfiable',
-	'417': 'Expectation Failed',
-	'421': 'Misdirected Request',
-	'425': 'Too Early',
-	'426': 'Upgrade Required',
-	'428': 'Precondition Required',
-	'429': 'Too Many Requests',
-	'431': 'Request Header Fields Too Large',
-	'500': 'Internal Server Error',
-	'501': 'Not Implemented',
-	'502': 'Bad Gateway',
-	'503': 'Service Unavailable',
-	'504': 'Gateway Timeout',
-	'505': 'HTTP Version Not Supported',
-	'506': 'Variant Also Negotiates',
-	'510': 'Not Extended',
-	'511': 'Network Authentication Required'
+	200: 'OK',
+	201: 'Created',
+	202: 'Accepted',
+	203: 'Non-Authoritative Information',
+	204: 'No Content',
+	205: 'Reset Content',
+	206: 'Partial Content',
+	300: 'Multiple Choices',
+	301: 'Moved Permanently',
+	302: 'Found',
+	303: 'See Other',
+	304: 'Not Modified',
+	305: 'Use Proxy',
+	306: 'Switch Proxy',
+	307: 'Temporary Redirect',
+	308: 'Permanent Redirect',
+	400: 'Bad Request',
+	401: 'Unauthorized',
+	403: 'Forbidden',
+	404: 'Not Found',
+	405: 'Method Not Allowed',
+	406: 'Not Accepted',
+	407: 'Proxy Authentication Required',
+	408: 'Request Timed Out',
+	409: 'Conflict',
+	410: 'Gone',
+	411: 'Length Required',
+	412: 'Precondition Failed',
+	413: 'Payload Too Large',
+	414: 'URI Too Large',
+	415: 'Unsupported Media Type',
+	416: 'Range Not Satisfiable',
+	417: 'Expectation Failed',
+	421: 'Misdirected Request',
+	425: 'Too Early',
+	426: 'Upgrade Required',
+	428: 'Precondition Required',
+	429: 'Too Many Requests',
+	431: 'Request Header Fields Too Large',
+	500: 'Internal Server Error',
+	501: 'Not Implemented',
+	502: 'Bad Gateway',
+	503: 'Service Unavailable',
+	504: 'Gateway Timeout',
+	505: 'HTTP Version Not Supported',
+	506: 'Variant Also Negotiates',
+	510: 'Not Extended',
+	511: 'Network Authentication Required'
+}
+
+# precomputed display strings so per-row lookups do no formatting
+STATUS_TEXT = {
+	code: '{} ({})'.format(code, name) for code, name in STATUS_CODES.items()
 }
 
+STATUS_LABEL = {TIMEOUT: 'Timeout', SKIPPED: 'Skipped'}
+STATUS_LABEL.update({code: str(code) for code in STATUS_CODES})
+
 ################################################################################
 # MainFrame class                                                              #
 ################################################################################
@@ -212,10 +305,10 @@ class MainFrame(wx.Frame):
 			rules = self.config.Read('rules')
 
 			if options != '':
-				self.options.update(json.loads(options))
+				self.options.update(json_loads(options))
 
 			if rules != '':
-				self.rules = json.loads(rules)
+				self.rules = json_loads(rules)
 
 		except:
 			wx.MessageBox(
@@ -230,8 +323,8 @@ class MainFrame(wx.Frame):
 			self.options['size'] = size
 
 		try:
-			self.config.Write('options', json.dumps(self.options))
-			self.config.Write('rules', json.dumps(self.rules))
+			self.config.Write('options', json_dumps(self.options))
+			self.config.Write('rules', json_dumps(self.rules))
 		except:
 			wx.MessageBox(
 				'Could not write configuration file.',
@@ -268,10 +361,14 @@ class MainPanel(wx.Panel):
 		self.paused = False
 		self.done = False
 		self.scanner = None
-		self.results = []
-		self.rows = 0
 		self.q = ''
 
+		self.pending = collections.deque() # rows waiting to be inserted
+		self.flush_timer = None
+		self.search_timer = None
+
+		self.clear_results()
+
 		self.list_ctrl = self.create_list_ctrl()
 		self.info_sizer = self.create_info_sizer()
 
@@ -287,6 +384,8 @@ class MainPanel(wx.Panel):
 		self.load_options()
 		self.Connect(-1, -1, EVT_RESULT_ID, self.update)
 
+		self.predicate = self.make_predicate()
+
 		self.update_status_action()
 		self.update_status_items()
 
@@ -324,7 +423,7 @@ class MainPanel(wx.Panel):
 
 	def create_filter_box(self):
 		self.search = wx.SearchCtrl(self)
-		self.search.Bind(wx.EVT_TEXT, self.filter)
+		self.search.Bind(wx.EVT_TEXT, self.search_changed)
 
 		self.status = (
 			wx.CheckBox(self, label='Timeouts'),
@@ -433,7 +532,7 @@ class MainPanel(wx.Panel):
 		return box
 
 	def create_list_ctrl(self):
-		element = wx.ListCtrl(self, style=wx.LC_REPORT | wx.LC_SINGLE_SEL)
+		element = ResultListCtrl(self)
 
 		element.InsertColumn(0, 'Status', width=75)
 		element.InsertColumn(1, 'Link to', width=445)
@@ -533,8 +632,31 @@ class MainPanel(wx.Panel):
 		for i, element in enumerate(self.status):
 			self.options['status'][i] = element.GetValue()
 
-	def read_item(self, m, n):
-		return self.list_ctrl.GetItem(m, n).GetText()
+	def clear_results(self):
+		# struct-of-arrays storage for results: parallel columns take far
+		# less memory than a list of row tuples, and filter passes touch
+		# only the columns they test
+		self.col_status = array.array('h')
+		self.col_server = array.array('b')
+		self.col_links = []
+		self.col_sources = []
+
+		self.visible = [] # indices of rows that pass the current filter
+		self.pending.clear()
+		self.rows = 0
+
+	def get_cell(self, m, n):
+		index = self.visible[m]
+
+		if n == 1:
+			return self.col_links[index]
+
+		if n == 2:
+			return self.col_sources[index]
+
+		status = self.col_status[index]
+
+		return STATUS_LABEL.get(status, str(status))
 
 	def list_selected(self, event=None):
 		self.button_link.Enable()
@@ -553,14 +675,13 @@ class MainPanel(wx.Panel):
 		if selected < 0:
 			return
 
-		status = self.read_item(selected, 0)
-
-		if status in STATUS_CODES:
-			status = '{} ({})'.format(status, STATUS_CODES[status])
+		status = self.col_status[self.visible[selected]]
 
-		self.text_status.SetLabel(status)
-		self.text_link.SetLabel(self.read_item(selected, 1))
-		self.text_source.SetValue(self.read_item(selected, 2))
+		self.text_status.SetLabel(
+			STATUS_TEXT.get(status, self.get_cell(selected, 0))
+		)
+		self.text_link.SetLabel(self.get_cell(selected, 1))
+		self.text_source.SetValue(self.get_cell(selected, 2))
 
 	def update_status_action(self):
 		if self.scanner is not None:
@@ -605,16 +726,14 @@ class MainPanel(wx.Panel):
 
 	def start(self, event=None):
 		self.done = False
-		self.results = []
-		self.rows = 0
+		self.clear_results()
 
 		self.button_stop.Enable()
 		self.button_start.SetLabel('Pau&se')
 		self.parent.item_stop.Enable(True)
 		self.parent.item_start.SetItemLabel('Pau&se')
 
-		self.list_ctrl.DeleteAllItems()
-		self.update_status_items()
+		self.refresh_list()
 
 		self.scanner = Scanner(self, (
 			self.url.GetValue(),
@@ -645,6 +764,8 @@ class MainPanel(wx.Panel):
 		self.update_status_action()
 
 	def stop(self, event=None):
+		self.flush_rows() # inserts any rows still waiting on the timer
+
 		self.button_start.Enable()
 		self.button_stop.Disable()
 		self.button_start.SetLabel('&Start')
@@ -662,61 +783,131 @@ class MainPanel(wx.Panel):
 
 		self.update_status_action()
 
+	def search_changed(self, event=None):
+		# debounces filtering so it does not run on every keystroke
+		if self.search_timer is not None and self.search_timer.IsRunning():
+			self.search_timer.Stop()
+
+		self.search_timer = wx.CallLater(SEARCH_DELAY, self.filter)
+
 	def filter(self, event=None):
 		self.save_options()
+		self.predicate = self.make_predicate()
 
-		self.list_ctrl.DeleteAllItems()
-		self.rows = 0
+		# the full rebuild below covers every stored row, so anything
+		# still waiting on the flush timer would be appended twice
+		self.pending.clear()
 
-		for row in self.results:
-			self.insert_row(row)
+		predicate = self.predicate
+		status = self.col_status
+		servers = self.col_server
+		links = self.col_links
+		sources = self.col_sources
 
-		self.update_status_items()
+		self.visible = [
+			i for i in range(len(status))
+			if predicate(status[i], links[i], sources[i], servers[i])
+		]
 
-	def update(self, event):
-		if event.status == COMPLETED:
-			self.done = True
-			self.stop()
-		else:
-			row = (event.status, event.link, event.source, event.server)
-			self.results.append(row)
-			self.insert_row(row)
-
-	def insert_row(self, row):
-		status, link, source, server = row
-
-		# checks visibility of row
-		if status == TIMEOUT:
-			n = TIMEOUT
-			text = 'Timeout'
-		elif status == SKIPPED:
-			n = SKIPPED
-			text = 'Skipped'
-		else:
-			n = status // 100
-			text = str(status)
+		self.refresh_list()
 
-		if server == INTERNAL and not self.options['local']:
+	def update(self, event):
+		for status, link, source, server, error in event.results:
+			if status == COMPLETED:
+				self.done = True
+				self.stop()
+			else:
+				self.col_status.append(status)
+				self.col_server.append(server)
+				self.col_links.append(link)
+				self.col_sources.append(source)
+				self.pending.append(len(self.col_status) - 1)
+
+		# coalesces bursts of results into one list update per interval
+		if self.pending:
+			if self.flush_timer is None or not self.flush_timer.IsRunning():
+				self.flush_timer = wx.CallLater(FLUSH_INTERVAL, self.flush_rows)
+
+	def flush_rows(self):
+		if not self.pending:
 			return
 
-		if server == EXTERNAL and not self.options['remote']:
-			return
+		while self.pending:
+			index = self.pending.popleft()
+			passes = self.predicate(
+				self.col_status[index],
+				self.col_links[index],
+				self.col_sources[index],
+				self.col_server[index]
+			)
 
-		if not self.options['status'][n]:
-			return
+			if passes:
+				self.visible.append(index)
 
-		if self.q != '' and link.find(self.q) < 0 and source.find(self.q) < 0:
-			return
+		self.refresh_list()
 
-		self.list_ctrl.InsertItem(self.rows, text)
-		self.list_ctrl.SetItem(self.rows, 1, link)
-		self.list_ctrl.SetItem(self.rows, 2, source)
+	def refresh_list(self):
+		self.rows = len(self.visible)
+		self.list_ctrl.SetItemCount(self.rows)
+		self.list_ctrl.Refresh()
 
 		# scrolls to bottom
-		self.list_ctrl.EnsureVisible(self.list_ctrl.GetItemCount() - 1)
+		if self.rows > 0:
+			self.list_ctrl.EnsureVisible(self.rows - 1)
 
 		self.update_status_items()
-		self.rows += 1
+
+	def make_predicate(self):
+		# binds the current filter options into locals so the per-row test
+		# does no dict lookups, and compiles the search query once instead
+		# of substring-scanning with str.find per column
+		local = self.options['local']
+		remote = self.options['remote']
+		status = tuple(self.options['status'])
+
+		if self.q != '':
+			search = re.compile(re.escape(self.q)).search
+		else:
+			search = None
+
+		def predicate(row_status, link, source, server):
+			if row_status == TIMEOUT or row_status == SKIPPED:
+				n = row_status
+			else:
+				n = row_status // 100
+
+			if server == INTERNAL and not local:
+				return False
+
+			if server == EXTERNAL and not remote:
+				return False
+
+			if not status[n]:
+				return False
+
+			if search is not None:
+				if search(link) is None and search(source) is None:
+					return False
+
+			return True
+
+		return predicate
+
+################################################################################
+# ResultListCtrl class                                                         #
+################################################################################
+
+class ResultListCtrl(wx.ListCtrl):
+	def __init__(self, parent):
+		wx.ListCtrl.__init__(
+			self, parent,
+			style=wx.LC_REPORT | wx.LC_VIRTUAL | wx.LC_SINGLE_SEL
+		)
+		self.parent = parent
+
+	def OnGetItemText(self, item, col):
+		# virtual list control requests cell text on demand
+		return self.parent.get_cell(item, col)
 
 ################################################################################
 # RulesFrame class                                                             #
@@ -893,6 +1084,47 @@ class RulesPanel(wx.Panel):
 			self.list_ctrl.SetItem(i, 1, self.choices_scope[scope])
 			self.list_ctrl.SetItem(i, 2, match)
 
+################################################################################
+# URL functions                                                                #
+################################################################################
+
+# caches parse results since the same URL string recurs across pages
+parse_url = functools.lru_cache(maxsize=65536)(urllib.parse.urlparse)
+
+def join_url(base, parts, href):
+	# joins the common href forms against the pre-split base with string
+	# operations; anything with dot segments, a protocol-relative host,
+	# or another scheme falls back to a full urljoin
+	if href.startswith(('http://', 'https://')):
+		return href
+
+	if '/.' in href or href.startswith(('//', '.')):
+		return urllib.parse.urljoin(base, href)
+
+	if href.startswith('/'):
+		return '{}://{}{}'.format(parts.scheme, parts.netloc, href)
+
+	return urllib.parse.urljoin(base, href)
+
+def canonicalize(url):
+	parsed = parse_url(url)
+
+	# drops tracking parameters and sorts the rest so that permutations
+	# of the same query string compare as equal
+	query = '&'.join(sorted(
+		param for param in parsed.query.split('&')
+		if param != '' and not param.startswith(TRACKING_PARAMS)
+	))
+
+	return urllib.parse.urlunparse((
+		parsed.scheme.lower(),
+		parsed.netloc.lower(),
+		parsed.path.rstrip('/') or '/',
+		'',
+		query,
+		''
+	))
+
 ################################################################################
 # Scanner class                                                                #
 ################################################################################
@@ -902,9 +1134,13 @@ class Scanner(threading.Thread):
 		threading.Thread.__init__(self)
 		self.parent = parent
 
-		self.paused = None
+		self.running = threading.Event() # cleared while paused
+		self.running.set()
 		self.stopped = False
 
+		self.batch = [] # results not yet posted to the GUI
+		self.last_flush = time.monotonic()
+
 		self.url = options[0]
 		self.depth = options[1]
 		self.threads = options[2]
@@ -915,89 +1151,271 @@ class Scanner(threading.Thread):
 		self.external = options[7]
 		self.internal = options[8]
 
-		self.rules = list(map(lambda r: (r[0], r[1], re.compile(r[2])), rules))
-		self.links = set([self.url]) # link cache to avoid repeating links
-		self.domain = urllib.parse.urlparse(self.url).netloc
+		# combines rules with the same condition and scope into as few
+		# compiled patterns as possible so most links need one regex test
+		# per group instead of a Python loop over every rule; rules that
+		# cannot be combined safely stay individually compiled
+		groups = {}
+
+		for condition, scope, match in rules:
+			groups.setdefault((condition, scope), []).append(match)
+
+		self.rules = {}
+
+		for (condition, scope), patterns in groups.items():
+			self.rules[(condition, scope)] = self.compile_rules(
+				condition, patterns
+			)
+
+		# link cache to avoid repeating links, keyed by canonical URL so
+		# trailing-slash, case, and tracking-parameter variants collapse;
+		# a Bloom filter keeps memory constant per URL on deep crawls
+		if ScalableBloomFilter is not None:
+			self.links = ScalableBloomFilter(
+				initial_capacity=BLOOM_CAPACITY,
+				error_rate=BLOOM_ERROR_RATE
+			)
+		else:
+			self.links = set()
+
+		self.links.add(canonicalize(self.url))
+		self.domain = parse_url(self.url).netloc
+
+		# shared session reuses keep-alive connections across tasks instead
+		# of opening a new TCP/TLS connection for every request
+		adapter = HTTPAdapter(
+			pool_connections=POOL_CONNECTIONS,
+			pool_maxsize=max(POOL_CONNECTIONS, self.threads * 4),
+			max_retries=Retry(total=RETRY_TOTAL, backoff_factor=RETRY_BACKOFF)
+		)
 
-		self.pool = ThreadPool(self.threads)
-		self.pool.add(Task(
+		self.session = requests.Session()
+		self.session.mount('http://', adapter)
+		self.session.mount('https://', adapter)
+
+		# persistent cache of statuses from previous runs
+		data_dir = wx.StandardPaths.Get().GetUserDataDir()
+		self.cache_path = os.path.join(data_dir, CACHE_FILE)
+		self.cache = None
+
+		self.pool = futures.ThreadPoolExecutor(max_workers=self.threads)
+		self.host_limits = collections.defaultdict(
+			lambda: threading.Semaphore(PER_HOST_CONNECTIONS)
+		)
+		self.free_tasks = [] # finished tasks waiting to be reused
+		self.futures = set()
+		self.futures.add(self.submit(Task(
 			link=self.url,
 			source='',
 			depth=0,
+			session=self.session,
 			timeout=self.timeout,
 			redirect=self.redirect,
 			server=INTERNAL,
 			follow=True
-		))
+		)))
+
+	def submit(self, task):
+		# caps simultaneous connections per host so a burst of same-host
+		# links does not hammer one server with every worker at once
+		semaphore = self.host_limits[parse_url(task.link).netloc]
+
+		def call():
+			self.running.wait() # parks here while the scan is paused
+
+			with semaphore:
+				task.run()
+
+			return task
+
+		return self.pool.submit(call)
+
+	def make_task(self, link, source, depth, server, follow):
+		# reuses a finished task instead of constructing a new object;
+		# the session, timeout, and redirect settings are scanner-wide,
+		# so the factory fills them in
+		if self.free_tasks:
+			return self.free_tasks.pop().reset(
+				link, source, depth, self.session, self.timeout,
+				self.redirect, server, follow
+			)
+
+		return Task(
+			link, source, depth, self.session, self.timeout,
+			self.redirect, server, follow
+		)
+
+	def recycle(self, task):
+		# only called from the scanner thread, after the task's results
+		# have been posted and its links consumed
+		if len(self.free_tasks) < FREE_TASKS:
+			self.free_tasks.append(task)
 
 	def run(self):
-		self.pool.start()
+		self.open_cache()
+
+		try:
+			pending = self.futures
 
-		for task in self.pool.poll_completed_tasks():
-			if self.paused is not None: # paused by user
-				self.paused.wait()
+			while pending:
+				done, pending = futures.wait(
+					pending, return_when=futures.FIRST_COMPLETED
+				)
 
-			if self.stopped: # stopped by user
-				return
+				for future in done:
+					self.running.wait() # paused by user
 
-			if task.server == INTERNAL and task.redirected: # redirected
-				parsed = urllib.parse.urlparse(task.link)
+					if self.stopped: # stopped by user
+						return
 
-				# changes server type if domain has changed
-				if parsed.netloc != self.domain:
-					task.server = EXTERNAL
+					task = future.result()
 
-			if task.error: # error encountered
-				self.error(task)
-				continue
+					if task.server == INTERNAL and task.redirected:
+						parsed = parse_url(task.link)
 
-			self.tell(task.status, task.link, task.source, task.server)
+						# changes server type if domain has changed
+						if parsed.netloc != self.domain:
+							task.server = EXTERNAL
 
-			# domain has changed, so check follow option again
-			# before processing page links
-			if task.server == EXTERNAL and self.external != FOLLOW:
-				continue
+					if task.error: # error encountered
+						self.error(task)
+						self.recycle(task)
+						continue
 
-			# adds links found on page to tasks
-			for link in self.scan_links(task):
-				self.pool.add(link)
+					self.store_cache(task)
+					self.tell(task.status, task.link, task.source, task.server)
 
-			time.sleep(self.delay)
+					# domain has changed, so check follow option again
+					# before processing page links
+					if task.server == EXTERNAL and self.external != FOLLOW:
+						self.recycle(task)
+						continue
 
-		self.done()
+					# adds links found on page to tasks
+					for link in self.scan_links(task):
+						pending.add(self.submit(link))
+
+					self.recycle(task)
+					time.sleep(self.delay)
+		finally:
+			# cancels the queued backlog before anything that can raise;
+			# otherwise the executor threads keep crawling after the UI
+			# is gone and hold up process exit
+			self.pool.shutdown(wait=False, cancel_futures=True)
+
+			if self.cache is not None:
+				self.cache.close()
+
+			# posts any results still waiting in the batch; the panel may
+			# already be destroyed if the scan ended with the window
+			try:
+				self.flush()
+			except RuntimeError:
+				pass
+
+		if not self.stopped:
+			self.done()
+
+	def open_cache(self):
+		# opened here instead of the constructor so that the connection
+		# belongs to the scanner thread
+		try:
+			os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+
+			self.cache = sqlite3.connect(self.cache_path, isolation_level=None)
+			self.cache.execute('PRAGMA journal_mode=WAL')
+			self.cache.execute(
+				'CREATE TABLE IF NOT EXISTS urls '
+				'(url TEXT PRIMARY KEY, status INTEGER, ts INTEGER)'
+			)
+		except (OSError, sqlite3.Error):
+			self.cache = None # scans still work without the cache
+
+	def check_cache(self, canonical):
+		if self.cache is None:
+			return None
+
+		try:
+			row = self.cache.execute(
+				'SELECT status, ts FROM urls WHERE url = ?', (canonical,)
+			).fetchone()
+		except sqlite3.Error:
+			return None
+
+		# reuses only fresh, known-good statuses; errors are always
+		# rechecked in case they were transient
+		if row is not None and row[0] < 400:
+			if time.time() - row[1] < CACHE_TTL:
+				return row[0]
+
+		return None
+
+	def store_cache(self, task):
+		if self.cache is None or task.status == 0:
+			return
+
+		try:
+			self.cache.execute(
+				'INSERT OR REPLACE INTO urls VALUES (?, ?, ?)',
+				(canonicalize(task.link), task.status, int(time.time()))
+			)
+		except sqlite3.Error:
+			pass
 
 	def scan_links(self, task):
+		# binds everything the per-link loop touches into locals; pages can
+		# carry hundreds of links and repeated lookups add up
+		links = self.links
+		domain = self.domain
+		skip = self.skip
+		check_rules = self.check_rules
+		urldefrag = urllib.parse.urldefrag
+
 		for link in task.links:
 			depth = task.depth
 
+			# classifies the scheme with a cheap prefix check so non-http
+			# links are dispatched without a full URL parse
+			prefix = link[:16].lower()
+			i = prefix.find(':')
+			scheme = prefix[:i] if i > 0 else ''
+
+			if scheme != '' and scheme not in ACCEPT_SCHEMES:
+				if link not in links:
+					links.add(link)
+
+					if scheme not in IGNORE_SCHEMES:
+						skip(link, task)
+
+				continue
+
 			# ignores URL fragments
-			link, fragment = urllib.parse.urldefrag(link)
+			link, fragment = urldefrag(link)
 
 			# checks if already scanned
-			if link in self.links:
+			canonical = canonicalize(link)
+
+			if canonical in links:
 				continue
 
-			self.links.add(link)
-			parsed = urllib.parse.urlparse(link)
+			links.add(canonical)
+			parsed = parse_url(link)
 
 			# checks for query string
-			if parsed.query != '':
-				link += '?' + parsed.query
-
-				if not self.query:
-					self.skip(link, task)
-					continue
+			if parsed.query != '' and not self.query:
+				skip(link, task)
+				continue
 
 			# checks if http/s
 			if not parsed.scheme in ACCEPT_SCHEMES:
 				if not parsed.scheme in IGNORE_SCHEMES:
-					self.skip(link, task)
+					skip(link, task)
 
 				continue
 
-			if parsed.netloc == self.domain: # internal link
+			if parsed.netloc == domain: # internal link
 				if self.internal == IGNORE:
-					self.skip(link, task)
+					skip(link, task)
 					continue
 
 				server = INTERNAL
@@ -1006,60 +1424,98 @@ class Scanner(threading.Thread):
 				depth += 1
 
 				if self.external == IGNORE or task.depth > self.depth:
-					self.skip(link, task)
+					skip(link, task)
 					continue
 
 				server = EXTERNAL
 				follow = self.external == FOLLOW
 
 			# checks link against user-defined rules
-			if self.check_rules(link, server):
-				self.skip(link, task)
+			if check_rules(link, server):
+				skip(link, task)
 				continue
 
-			yield Task(
-				link=link,
-				source=task.link,
-				depth=depth,
-				timeout=self.timeout,
-				redirect=self.redirect,
-				server=server,
-				follow=follow
-			)
+			# reuses a recent status from a previous run, but only for
+			# links that would not be scanned for further links
+			if not follow:
+				status = self.check_cache(canonical)
 
-	def check_rules(self, link, server=INTERNAL):
-		for rule in self.rules:
-			condition, scope, match = rule
+				if status is not None:
+					self.tell(status, link, task.link, server)
+					continue
+
+			yield self.make_task(link, task.link, depth, server, follow)
+
+	def compile_rules(self, condition, patterns):
+		# wrapping a rule in a group renumbers its capturing groups, so
+		# rules with backreferences are compiled one by one to keep \1
+		# meaning what it meant standalone
+		combine = [p for p in patterns if not BACKREFERENCE_RE.search(p)]
+		separate = [p for p in patterns if BACKREFERENCE_RE.search(p)]
+
+		compiled = []
+
+		if combine:
+			# exclude rules union into an alternation, include rules chain
+			# into lookaheads since a link must match all of them
+			if condition == INCLUDE:
+				pattern = ''.join('(?=.*(?:{}))'.format(p) for p in combine)
+			else:
+				pattern = '|'.join('(?:{})'.format(p) for p in combine)
+
+			# inline global flags like (?i) are legal at the start of a
+			# rule but not inside a combined pattern, so a group that no
+			# longer compiles falls back to one pattern per rule
+			try:
+				compiled.append(re.compile(pattern))
+				combine = []
+			except re.error:
+				pass
+
+		for pattern in combine + separate:
+			compiled.append(re.compile(pattern))
+
+		return compiled
 
+	def check_rules(self, link, server=INTERNAL):
+		for (condition, scope), patterns in self.rules.items():
 			# checks if rule is for this server type
 			if scope != ANY and server != scope:
 				continue
 
-			result = re.search(match, link)
-
-			# link must match rule
-			if condition == INCLUDE and not result:
-				return True
-			# link must not match rule
-			elif condition == EXCLUDE and result:
+			# link must match every include rule
+			if condition == INCLUDE:
+				if not all(p.search(link) for p in patterns):
+					return True
+			# link must not match any exclude rule
+			elif any(p.search(link) for p in patterns):
 				return True
 
 	def pause(self):
-		if self.paused is None:
-			self.paused = threading.Event()
-			self.pool.pause()
+		if self.running.is_set():
+			self.running.clear()
 		else:
-			self.paused.set()
-			self.paused = None
-			self.pool.resume()
+			self.running.set()
 
 	def stop(self):
 		self.stopped = True
-		self.pool.pause()
+		self.running.set() # releases anything parked on the pause event
 
 	def tell(self, status, link, source, server, error=None):
-		event = ResultEvent(status, link, source, server, error)
-		wx.PostEvent(self.parent, event)
+		# coalesces results into one event per batch so a fast crawl does
+		# not flood the GUI event queue with per-URL posts
+		self.batch.append((status, link, source, server, error))
+
+		if len(self.batch) >= BATCH_SIZE \
+			or time.monotonic() - self.last_flush >= BATCH_INTERVAL:
+			self.flush()
+
+	def flush(self):
+		if self.batch:
+			wx.PostEvent(self.parent, ResultEvent(self.batch))
+			self.batch = []
+
+		self.last_flush = time.monotonic()
 
 	def skip(self, link, task):
 		self.tell(SKIPPED, link, task.link, task.server, task.error)
@@ -1069,134 +1525,76 @@ class Scanner(threading.Thread):
 
 	def done(self):
 		self.tell(COMPLETED, '', '', INTERNAL)
+		self.flush()
 
 ################################################################################
 # ResultEvent class                                                            #
 ################################################################################
 
 class ResultEvent(wx.PyEvent):
-	def __init__(self, status, link, source, server, error=None):
+	def __init__(self, results):
 		wx.PyEvent.__init__(self)
-		self.status = status
-		self.link = link
-		self.source = source
-		self.server = server
-		self.error = error
+		self.results = results # list of (status, link, source, server, error)
 
 		self.SetEventType(EVT_RESULT_ID)
 
-################################################################################
-# Worker class                                                                 #
-################################################################################
-
-class Worker(threading.Thread):
-	def __init__(self, todo, done):
-		super().__init__()
-		self.todo = todo
-		self.done = done
-		self.daemon = True
-
-		self.paused = None
-
-		self.start()
-
-	def run(self):
-		while True:
-			if self.paused is not None:
-				self.paused.wait()
-
-			task = self.todo.get()
-			task.run()
-
-			self.done.put(task)
-			self.todo.task_done()
-
-	def pause(self):
-		self.paused = threading.Event()
-
-	def resume(self):
-		self.paused.set()
-		self.paused = None
-
-################################################################################
-# ThreadPool class                                                             #
-################################################################################
-
-class ThreadPool(object):
-	def __init__(self, count):
-		self.count = count
-		self.threads = []
-
-		self.todo = Queue() # pending tasks
-		self.done = Queue() # completed tasks
-
-		self.pending = 0
-
-	def add(self, task):
-		self.todo.put(task)
-		self.pending += 1
-
-	def start(self):
-		for n in range(self.count):
-			self.threads.append(Worker(self.todo, self.done))
-
-	def pause(self):
-		for thread in self.threads:
-			thread.pause()
-
-	def resume(self):
-		for thread in self.threads:
-			thread.resume()
-
-	def wait_for_task(self):
-		while True:
-			try:
-				return self.done.get(block=False)
-			except: # gives tasks processor time
-				time.sleep(0.1)
-
-	def poll_completed_tasks(self):
-		while self.pending > 0:
-			yield self.wait_for_task()
-			self.pending -= 1
-
-		# completed all tasks
-		self.todo.join()
-
 ################################################################################
 # Task class                                                                   #
 ################################################################################
 
 class Task():
-	def __init__(self, link, source, depth, timeout, redirect, server, follow):
+	# fixed attribute layout drops the per-instance __dict__; a large
+	# crawl creates one task per link, so the savings add up
+	__slots__ = (
+		'link', 'source', 'depth', 'session', 'timeout', 'redirect',
+		'server', 'follow', 'links', 'status', 'error', 'redirected'
+	)
+
+	def __init__(
+		self, link, source, depth, session, timeout, redirect, server, follow
+	):
+		self.links = []
+		self.reset(
+			link, source, depth, session, timeout, redirect, server, follow
+		)
+
+	def reset(
+		self, link, source, depth, session, timeout, redirect, server, follow
+	):
 		self.link = link
 		self.source = source
 		self.depth = depth
+		self.session = session
 		self.timeout = timeout
 		self.redirect = redirect
 		self.server = server
 		self.follow = follow
 
-		self.links = []
+		self.links.clear()
 		self.status = 0
 		self.error = None
 		self.redirected = False
 
+		return self
+
 	def run(self):
 		try:
 			original_link = self.link
 
-			# gets head request initially (to avoid downloading every file)
-			head_request = requests.head(
+			# one streamed request per link: the connection is closed after
+			# the headers unless the body is an HTML page worth parsing
+			get_request = self.session.get(
 				self.link,
 				timeout=self.timeout,
 				allow_redirects=self.redirect,
 				stream=True
 			)
 
-			with closing(head_request) as response:
+			with closing(get_request) as response:
 				self.link = response.url # reset in case of redirect
 				self.status = response.status_code
+				self.redirected = original_link != self.link
+				content_type = response.headers.get('Content-Type', '').strip()
 
 				if not self.follow: # not following links
 					return
@@ -1204,45 +1602,76 @@ class Task():
 				if self.status >= 400: # error status
 					return
 
-				content_type = response.headers.get('Content-Type', '').strip()
-
 				if not content_type.startswith(CONTENT_TYPES):
 					return
 
-			# gets full request if content type is HTML
-			get_request = requests.get(
-				self.link,
-				timeout=self.timeout,
-				allow_redirects=self.redirect,
-				stream=True
-			)
+				# downloads the body only if content type is HTML, reading
+				# in chunks so a huge page cannot exhaust memory
+				content = bytearray()
 
-			with closing(get_request) as response:
-				strainer = SoupStrainer(lambda tag, attr: tag in HTML_TAGS)
-				parser = BeautifulSoup(
-					response.content,
-					'html.parser',
-					parse_only=strainer,
-					from_encoding=response.encoding
-				)
+				for chunk in response.iter_content(CHUNK_SIZE):
+					content += chunk
+
+					if len(content) >= MAX_CONTENT_SIZE:
+						break
 
-				for tag in parser.find_all('a', href=True):
-					link = urllib.parse.urljoin(self.link, tag['href'])
-					self.links.append(link)
+				encoding = requests.utils.get_encoding_from_headers(
+					response.headers
+				)
 
-				for tag in parser.find_all('img', src=True):
-					link = urllib.parse.urljoin(self.link, tag['src'])
-					self.links.append(link)
+				# requests assumes ISO-8859-1 for HTML served without a
+				# charset; UTF-8 is the safer modern default, and decoding
+				# here keeps the parsers from running charset detection
+				if encoding is None or encoding.lower() == 'iso-8859-1':
+					encoding = 'utf-8'
 
-				for tag in parser.find_all('link', href=True):
-					link = urllib.parse.urljoin(self.link, tag['href'])
-					self.links.append(link)
+				# servers send charset tokens Python does not know (e.g.
+				# "utf8mb4"); a bad name must not fail a page that loaded
+				try:
+					codecs.lookup(encoding)
+				except LookupError:
+					encoding = 'utf-8'
 
-			self.redirected = original_link != self.link
+				self.extract_links(content.decode(encoding, errors='replace'))
 		except Exception as e:
 			self.error = e
 			return
 
+	def extract_links(self, content):
+		# splits the base once per page instead of re-parsing it inside
+		# urljoin for every tag, and hoists lookups out of the loops
+		base = self.link
+		parts = urllib.parse.urlsplit(base)
+		append = self.links.append
+		urldefrag = urllib.parse.urldefrag
+
+		# pages repeat the same links in navigation and footers, so
+		# duplicates and fragment variants collapse at collection time
+		seen = set()
+
+		if LexborHTMLParser is not None:
+			tree = LexborHTMLParser(content)
+
+			for node in tree.css(LINK_SELECTOR):
+				attributes = node.attributes
+				link = attributes.get('href') or attributes.get('src')
+
+				if link:
+					link = urldefrag(join_url(base, parts, link))[0]
+
+					if link not in seen:
+						seen.add(link)
+						append(link)
+
+			return
+
+		for match in LINK_RE.finditer(content):
+			link = urldefrag(join_url(base, parts, match.group(1)))[0]
+
+			if link not in seen:
+				seen.add(link)
+				append(link)
+
 ################################################################################
 # Main function                                                                #
 ################################################################################